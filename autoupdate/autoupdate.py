@@ -1,22 +1,29 @@
 import asyncio
 import logging
+import random
 import subprocess
 import sys
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from enum import Enum
+from hashlib import sha256
 from os import getenv, getcwd, environ
 from pathlib import Path
-from smtplib import SMTP_SSL, SMTP_SSL_PORT
-from ssl import create_default_context
-from time import sleep
+from smtplib import SMTP_SSL_PORT
 from typing import Optional
 
-from aiohttp import ClientSession
+from aiohttp import (
+    ClientConnectorError,
+    ClientSession,
+    ServerDisconnectedError,
+    TCPConnector,
+)
+from aiosmtplib import SMTP
 from alpa.config.metadata import MetadataConfig
 from alpa.exceptions import AlpaConfException
 from alpa.repository.branch import LocalRepoBranch
 from packaging.version import parse
+from pygit2 import Repository
 from specfile import Specfile
 
 
@@ -29,16 +36,46 @@ logger = logging.getLogger(__name__)
 
 
 EXIT_SUCCESS = 0
-MAX_RETRY = 700
+# polling budget in wall-clock seconds (~23 hours), not iterations
+MAX_WAIT_SECONDS = 84_000
+BACKOFF_BASE = 10
+BACKOFF_CAP = 300
+BACKOFF_JITTER = 0.25
+MAX_REQUEST_RETRIES = 5
 
 UPDATE_BRANCH_PREFIX = "__alpa_autoupdate"
 
-CHECK_RUN_RUNNING_CONCLUSION = ["queued", "in_progress"]
+CHECK_RUN_RUNNING_CONCLUSION = frozenset({"queued", "in_progress"})
 
 GH_HEADERS = {
     "Accept": "application/vnd.github+json",
     "X-GitHub-Api-Version": "2022-11-28",
 }
+GH_GRAPHQL_URL = "https://api.github.com/graphql"
+
+CHECK_RUNS_GRAPHQL_QUERY = """
+query {{
+  repository(owner: "{owner}", name: "{repo}") {{
+    {commit_aliases}
+  }}
+}}
+"""
+COMMIT_ALIAS_GRAPHQL_FRAGMENT = """
+{alias}: object(oid: "{sha}") {{
+  ... on Commit {{
+    checkSuites(first: 50) {{
+      nodes {{
+        checkRuns(first: 50) {{
+          nodes {{
+            status
+            conclusion
+          }}
+        }}
+      }}
+    }}
+  }}
+}}
+"""
 
 HTML_FOOTNOTE = """
 <html>
@@ -63,6 +100,16 @@ class RequestEnum(str, Enum):
     POST = "POST"
 
 
+# transient failure (connection flake, 5xx, 429) which is worth retrying
+class RecoverableError(Exception):
+    pass
+
+
+# failure (e.g. 4xx) which no amount of retrying will fix
+class UnrecoverableError(Exception):
+    pass
+
+
 class MailClient:
     def __init__(self) -> None:
         self.sender = environ["INPUT_EMAIL-NAME"]
@@ -78,124 +125,335 @@ class MailClient:
         mail.attach(html_message)
         return mail
 
-    # TODO: could be asynchronous but I won't install flask/django because of
-    #  sending mail
-    def send_email(self, receiver: str, topic: str, body: str) -> None:
-        c = create_default_context()
-        with SMTP_SSL(self.smtp_address, SMTP_SSL_PORT, context=c) as srv:
-            srv.login(self.sender, environ["INPUT_EMAIL-PASSWORD"])
-            mail = self._prepare_mail(receiver, topic, body)
-            srv.sendmail(self.sender, receiver, mail.as_string())
+    async def send_emails(self, mails: list[tuple[str, str, str]]) -> None:
+        # one TLS handshake and login for the whole batch of recipients
+        async with SMTP(
+            hostname=self.smtp_address, port=SMTP_SSL_PORT, use_tls=True
+        ) as srv:
+            await srv.login(self.sender, environ["INPUT_EMAIL-PASSWORD"])
+            for receiver, topic, body in mails:
+                await srv.send_message(self._prepare_mail(receiver, topic, body))
 
 
 class Autoupdator69:
     def __init__(self) -> None:
         self.cwd = Path(getcwd())
         self.local_repo = LocalRepoBranch(self.cwd)
+        # every package works in its own worktree so branch switching in
+        # one coroutine can't race with another one
+        self.worktrees_dir = self.cwd / ".worktrees"
+        self._worktrees: dict[str, Path] = {}
+        self._current_branches: dict[Path, str] = {}
         self.pkg_commit_sha: dict[str, str] = {}
         self.mail_client = MailClient()
+        # spawning a git process per package with no bound exhausts file
+        # handles, keep a healthy number of them running at once instead
+        self._git_sem = asyncio.Semaphore(int(getenv("INPUT_GIT-CONCURRENCY", "4")))
+        # one session (thus one connection pool) shared by all requests so
+        # TCP + TLS handshakes are paid only once per host
+        self._session: Optional[ClientSession] = None
+        # packages sharing an upstream name shouldn't query anitya twice
+        self._anitya_cache: dict[tuple[str, str], Optional[str]] = {}
+        # metadata.yaml doesn't change during a run, parse it once per package
+        self._meta_cache: dict[str, MetadataConfig] = {}
+        # ETags for conditional check-runs polling; a 304 answer is free
+        # rate-limit-wise and skips re-downloading an unchanged response
+        self._etag_by_pkg: dict[str, str] = {}
+        self._last_check_runs_resp: dict[str, dict] = {}
+        # hot per-package strings built once instead of on every call
+        self._update_branches: dict[str, str] = {}
+        self._check_runs_urls: dict[str, str] = {}
+        # idempotency keys of the updates done in this run, see _push_update
+        self._update_keys: dict[str, str] = {}
+
+    async def _ensure_session(self) -> ClientSession:
+        if self._session is None:
+            self._session = ClientSession(
+                connector=TCPConnector(limit=50, ttl_dns_cache=300)
+            )
+        return self._session
+
+    async def _close_session(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
-    @staticmethod
     async def _async_requester(
-        api_url: str, params: dict, method: RequestEnum
+        self,
+        api_url: str,
+        params: Optional[dict],
+        method: RequestEnum,
+        headers: Optional[dict] = None,
     ) -> tuple[dict, int]:
-        async with ClientSession() as session:
-            session_method = session.get if RequestEnum.GET == method else session.post
-            logger.debug(f"Requesting {method} {api_url} with params {params}")
-            async with session_method(api_url, params=params) as response:
+        session = await self._ensure_session()
+        session_method = session.get if RequestEnum.GET == method else session.post
+        logger.debug(f"Requesting {method} {api_url} with params {params}")
+        try:
+            async with session_method(
+                api_url, params=params, headers=headers
+            ) as response:
                 logger.info(f"Response status: {response.status}")
+                if response.status >= 500 or response.status == 429:
+                    raise RecoverableError(
+                        f"{api_url} responded with status {response.status}"
+                    )
+                if response.status >= 400:
+                    raise UnrecoverableError(
+                        f"{api_url} responded with status {response.status}"
+                    )
                 return await response.json(), response.status
+        except (
+            ClientConnectorError,
+            ServerDisconnectedError,
+            asyncio.TimeoutError,
+        ) as exc:
+            raise RecoverableError(f"Request to {api_url} failed: {exc}") from exc
+
+    async def _request_with_retry(
+        self,
+        api_url: str,
+        params: Optional[dict],
+        method: RequestEnum,
+        headers: Optional[dict] = None,
+    ) -> tuple[dict, int]:
+        for attempt in range(MAX_REQUEST_RETRIES):
+            try:
+                return await self._async_requester(
+                    api_url, params, method, headers=headers
+                )
+            except RecoverableError as exc:
+                if attempt == MAX_REQUEST_RETRIES - 1:
+                    # no point sleeping when there is no retry left
+                    break
+
+                logger.warning(f"Retrying request to {api_url}: {exc}")
+                await asyncio.sleep(self._backoff_delay(attempt))
+
+        raise UnrecoverableError(
+            f"Request to {api_url} kept failing after "
+            f"{MAX_REQUEST_RETRIES} attempts"
+        )
 
     async def _get_package_last_version(
         self, pkg_name: str, backend: str
+    ) -> Optional[str]:
+        cache_key = (pkg_name.casefold(), backend.casefold())
+        if cache_key in self._anitya_cache:
+            return self._anitya_cache[cache_key]
+
+        # the exact-project endpoint answers with one small object; fall
+        # back to the pattern search (a whole project list to sift
+        # through) only when anitya doesn't know the ecosystem mapping
+        url = (
+            f"https://release-monitoring.org/api/project/"
+            f"{backend.casefold()}/{pkg_name}"
+        )
+        try:
+            resp, _ = await self._request_with_retry(url, None, RequestEnum.GET)
+        except UnrecoverableError:
+            # anitya doesn't know this ecosystem/package combination
+            resp = {}
+
+        if resp.get("version") is not None:
+            pkg_version = resp["version"]
+            logger.info(f"Package {pkg_name} found with version {pkg_version}")
+            self._anitya_cache[cache_key] = pkg_version
+            return pkg_version
+
+        return await self._search_last_version_by_pattern(pkg_name, backend, cache_key)
+
+    async def _search_last_version_by_pattern(
+        self, pkg_name: str, backend: str, cache_key: tuple[str, str]
     ) -> Optional[str]:
         url = "https://release-monitoring.org/api/projects/"
         query = {"pattern": pkg_name}
-        resp, status = await self._async_requester(url, query, RequestEnum.GET)
-        if status != 200:
-            logger.error("Request status was not equal to 200")
+        try:
+            resp, _ = await self._request_with_retry(url, query, RequestEnum.GET)
+        except UnrecoverableError as exc:
+            logger.error(f"Pattern search for {pkg_name} failed: {exc}")
             return None
 
-        projects = resp["projects"]
-        for project in projects:
-            if (
-                project["name"].casefold() == pkg_name.casefold()
-                and project["backend"].casefold() == backend.casefold()
-            ):
-                pkg_version = project["version"]
-                logger.info(f"Package {pkg_name} found with version {pkg_version}")
-                return pkg_version
+        versions_by_project = {
+            (project["name"].casefold(), project["backend"].casefold()): project[
+                "version"
+            ]
+            for project in resp["projects"]
+        }
+        pkg_version = versions_by_project.get(cache_key)
+        if pkg_version is not None:
+            logger.info(f"Package {pkg_name} found with version {pkg_version}")
+        else:
+            logger.warning(f"No package {pkg_name} found with backend {backend}")
 
-        logger.warning(f"No package {pkg_name} found with backend {backend}")
-        return None
+        self._anitya_cache[cache_key] = pkg_version
+        return pkg_version
 
     # this will bump version in spec file which will do the job with updating
     # because of script that downloads source when Copr builds SRPM
-    def _update_version_of_package(
-        self, specfile: Specfile, last_version_from_anytia: str, pkg_name: str
+    async def _update_version_of_package(
+        self,
+        specfile: Specfile,
+        last_version_from_anytia: str,
+        pkg_name: str,
+        worktree_path: Path,
     ) -> str:
-        # TODO: use some error-proof wrapper for self.git_cmd instead of
-        #  using subprocess
-        subprocess.run(
-            ["git", "switch", "-c", f"{UPDATE_BRANCH_PREFIX}_{pkg_name}"], cwd=self.cwd
-        )
+        update_branch = self._update_branch(pkg_name)
+        await self._run_git_cmd("switch", "-c", update_branch, cwd=worktree_path)
+        self._current_branches[worktree_path] = update_branch
         specfile.update_tag("Version", last_version_from_anytia)
         specfile.save()
 
-        self.local_repo.git_cmd(["add", f"{pkg_name}.spec"])
-        self.local_repo.git_cmd(
-            [
-                "commit",
-                "-m",
-                f"[alpa]: autoupdate of package {pkg_name} to "
-                f"version {last_version_from_anytia}",
-            ]
+        update_key = self._update_key(pkg_name, last_version_from_anytia)
+        self._update_keys[pkg_name] = update_key
+        # libgit2 does the add + commit in-process, no git forks needed
+        repo = Repository(str(worktree_path))
+        index = repo.index
+        index.add(f"{pkg_name}.spec")
+        index.write()
+        author = repo.default_signature
+        commit_oid = repo.create_commit(
+            "HEAD",
+            author,
+            author,
+            f"[alpa]: autoupdate of package {pkg_name} to "
+            f"version {last_version_from_anytia}\n\n"
+            f"alpa-autoupdate-id: {update_key}",
+            index.write_tree(),
+            [repo.head.target],
         )
-        return self.local_repo.git_cmd(
-            ["log", "--pretty=format:'%H'", "-n", "1"]
-        ).stdout.strip("'")
+        return str(commit_oid)
+
+    async def _run_git_cmd(
+        self, *args: str, cwd: Optional[Path] = None
+    ) -> tuple[str, str, Optional[int]]:
+        async with self._git_sem:
+            async_subprocess = await asyncio.create_subprocess_exec(
+                "git",
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd or self.cwd,
+            )
+            stdout, stderr = await async_subprocess.communicate()
+
+        return stdout.decode(), stderr.decode(), async_subprocess.returncode
+
+    async def _add_worktree(self, pkg_name: str) -> Optional[Path]:
+        worktree_path = self._worktrees.get(pkg_name)
+        if worktree_path is not None:
+            return worktree_path
+
+        worktree_path = self.worktrees_dir / pkg_name
+        if not worktree_path.is_dir():
+            _, stderr, return_code = await self._run_git_cmd(
+                "worktree", "add", str(worktree_path), pkg_name
+            )
+            if return_code != 0:
+                logger.error(f"Failed to add worktree for package {pkg_name}: {stderr}")
+                return None
+
+        self._worktrees[pkg_name] = worktree_path
+        self._current_branches[worktree_path] = pkg_name
+        return worktree_path
+
+    def _update_branch(self, pkg_name: str) -> str:
+        branch = self._update_branches.get(pkg_name)
+        if branch is None:
+            branch = f"{UPDATE_BRANCH_PREFIX}_{pkg_name}"
+            self._update_branches[pkg_name] = branch
+        return branch
+
+    def _check_runs_url(self, pkg_name: str) -> str:
+        url = self._check_runs_urls.get(pkg_name)
+        if url is None:
+            url = (
+                f"https://api.github.com/repos/{self.local_repo.namespace}/"
+                f"{self.local_repo.repo_name}/commits/"
+                f"{self.pkg_commit_sha.get(pkg_name)}/check-runs"
+            )
+            self._check_runs_urls[pkg_name] = url
+        return url
 
     async def _push_changes(self, branch_to_push: str) -> bool:
-        async_subprocess = await asyncio.create_subprocess_exec(
-            "git",
-            "push",
-            self.local_repo.remote_name,
-            branch_to_push,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=self.cwd,
+        stdout, stderr, return_code = await self._run_git_cmd(
+            "push", self.local_repo.remote_name, branch_to_push
         )
-        stdout, stderr = await async_subprocess.communicate()
-        if async_subprocess.returncode == 0:
-            logger.info(stdout.decode())
+        if return_code == 0:
+            logger.info(stdout)
             return True
 
-        logger.error(stderr.decode())
+        logger.error(stderr)
         return False
 
+    @staticmethod
+    def _update_key(pkg_name: str, version: str) -> str:
+        return sha256(f"{pkg_name}{version}".encode()).hexdigest()
+
+    def _checkpoint_update_key(self, update_key: str) -> None:
+        state_file = self.cwd / ".git" / "alpa-autoupdate-state"
+        with open(state_file, "a") as state:
+            state.write(f"{update_key}\n")
+
+    def _is_update_key_checkpointed(self, update_key: str) -> bool:
+        state_file = self.cwd / ".git" / "alpa-autoupdate-state"
+        return state_file.is_file() and update_key in state_file.read_text().split()
+
+    async def _is_update_already_merged(
+        self, update_key: str, worktree_path: Path
+    ) -> bool:
+        if self._is_update_key_checkpointed(update_key):
+            return True
+
+        stdout, _, _ = await self._run_git_cmd(
+            "log",
+            f"--grep=alpa-autoupdate-id: {update_key}",
+            "-n",
+            "1",
+            cwd=worktree_path,
+        )
+        return bool(stdout.strip())
+
+    async def _delete_branch(self, branch: str) -> tuple[str, str, Optional[int]]:
+        return await self._run_git_cmd(
+            "push", self.local_repo.remote_name, "--delete", branch
+        )
+
     async def _push_update(self, pkg_name: str) -> bool:
-        self._ensure_switching_to_branch(pkg_name)
-        logger.info(f"Merging update branch of package {pkg_name} with package branch")
-        update_branch = f"{UPDATE_BRANCH_PREFIX}_{pkg_name}"
-        subprocess.run(["git", "merge", update_branch], cwd=self.cwd)
-
-        push_result = await self._push_changes(pkg_name)
-        async_subprocess = await asyncio.create_subprocess_exec(
-            "git",
-            "push",
-            self.local_repo.remote_name,
-            "--delete",
-            update_branch,
-            cwd=self.cwd,
+        worktree_path = self._worktrees[pkg_name]
+        await self._ensure_switching_to_branch(pkg_name, worktree_path)
+        update_branch = self._update_branch(pkg_name)
+        # merging is the only non-idempotent step here; skip it when a
+        # retry finds this update already merged so nothing is redone
+        update_key = self._update_keys.get(pkg_name)
+        if update_key is not None and await self._is_update_already_merged(
+            update_key, worktree_path
+        ):
+            logger.info(f"Update of package {pkg_name} is already merged")
+        else:
+            logger.info(
+                f"Merging update branch of package {pkg_name} with package branch"
+            )
+            _, stderr, return_code = await self._run_git_cmd(
+                "merge", update_branch, cwd=worktree_path
+            )
+            if return_code != 0:
+                # don't checkpoint or push anything for a merge that never
+                # landed, a retry has to be able to redo it
+                logger.error(f"Merging update of package {pkg_name} failed: {stderr}")
+                return False
+
+            if update_key is not None:
+                self._checkpoint_update_key(update_key)
+
+        # pushing the package branch and deleting the update branch touch
+        # independent refs, no need to wait for one another
+        push_result, (stdout, stderr, return_code) = await asyncio.gather(
+            self._push_changes(pkg_name), self._delete_branch(update_branch)
         )
-        stdout, stderr = await async_subprocess.communicate()
-        if async_subprocess.returncode == 0:
-            # TODO: why are these None sometimes?
-            if stdout is not None:
-                logger.info(stdout.decode())
+        if return_code == 0:
+            logger.info(stdout)
         else:
-            if stderr is not None:
-                logger.error(stderr.decode())
+            logger.error(stderr)
 
         if not push_result:
             # probably some merge conflict
@@ -207,86 +465,259 @@ class Autoupdator69:
     def _cancel_update(self, pkg_name: str) -> None:
         pass
 
-    async def _wait_for_check_run_and_push_update(
-        self, pkg_name: str
-    ) -> Optional[bool]:
-        url = (
-            f"https://api.github.com/repos/{self.local_repo.namespace}/"
-            f"{self.local_repo.repo_name}/commits/{self.pkg_commit_sha.get(pkg_name)}/"
-            f"check-runs"
-        )
-        resp, status = await self._async_requester(url, GH_HEADERS, RequestEnum.GET)
-        if status != 200:
-            logger.error("Response status was not 200")
-            return False
+    @staticmethod
+    def _evaluate_check_runs(check_runs: list[dict]) -> Optional[bool]:
+        if not check_runs:
+            # packit didn't create any check run yet
+            return None
 
-        for check_run in resp["check_runs"]:
+        pending = False
+        for check_run in check_runs:
             if check_run["conclusion"] == "failure":
+                # one failed chroot fails the whole update, stop scanning
                 return False
 
             if check_run["status"] in CHECK_RUN_RUNNING_CONCLUSION:
-                # still no respose, waiting (don't log this to avoid spam pls)
-                return None
+                # still no respose, waiting (don't log this to avoid spam
+                # pls) but keep looking for an already failed run
+                pending = True
 
-        logger.info(f"Package {pkg_name} was successfully updated for all chroots")
-        return await self._push_update(pkg_name)
+        return None if pending else True
+
+    async def _get_check_runs_status(self, pkg_name: str) -> Optional[bool]:
+        url = self._check_runs_url(pkg_name)
+        headers = dict(GH_HEADERS)
+        etag = self._etag_by_pkg.get(pkg_name)
+        if etag is not None:
+            headers["If-None-Match"] = etag
+
+        session = await self._ensure_session()
+        try:
+            async with session.get(url, headers=headers) as response:
+                logger.info(f"Response status: {response.status}")
+                if response.status == 304:
+                    # nothing changed since the last poll, reuse the response
+                    resp = self._last_check_runs_resp[pkg_name]
+                elif response.status == 200:
+                    resp = await response.json()
+                    response_etag = response.headers.get("ETag")
+                    if response_etag is not None:
+                        self._etag_by_pkg[pkg_name] = response_etag
+                        self._last_check_runs_resp[pkg_name] = resp
+                else:
+                    logger.error(f"Response status was {response.status}")
+                    if response.status >= 500 or response.status == 429:
+                        # GitHub hiccup, worth polling again
+                        return None
+                    return False
+        except (
+            ClientConnectorError,
+            ServerDisconnectedError,
+            asyncio.TimeoutError,
+        ) as exc:
+            # connection flake, the poll loop will try again
+            logger.warning(f"Check-runs poll for {pkg_name} failed: {exc}")
+            return None
+
+        return self._evaluate_check_runs(resp["check_runs"])
+
+    async def _poll_check_runs_via_graphql(
+        self, pkg_shas: dict[str, str], gh_token: str
+    ) -> dict[str, Optional[bool]]:
+        aliases = {f"p{i}": pkg for i, pkg in enumerate(pkg_shas)}
+        query = CHECK_RUNS_GRAPHQL_QUERY.format(
+            owner=self.local_repo.namespace,
+            repo=self.local_repo.repo_name,
+            commit_aliases="".join(
+                COMMIT_ALIAS_GRAPHQL_FRAGMENT.format(alias=alias, sha=pkg_shas[pkg])
+                for alias, pkg in aliases.items()
+            ),
+        )
+        session = await self._ensure_session()
+        try:
+            async with session.post(
+                GH_GRAPHQL_URL,
+                json={"query": query},
+                headers={"Authorization": f"Bearer {gh_token}"},
+            ) as response:
+                logger.info(f"Response status: {response.status}")
+                if response.status != 200:
+                    # treat the whole batch as pending and try again later
+                    return {pkg: None for pkg in pkg_shas}
+                resp = await response.json()
+        except (
+            ClientConnectorError,
+            ServerDisconnectedError,
+            asyncio.TimeoutError,
+        ) as exc:
+            logger.warning(f"Batched check-runs poll failed: {exc}")
+            return {pkg: None for pkg in pkg_shas}
+
+        # GitHub answers 200 with an errors list and null data e.g. for a
+        # bad or underscoped token, treat that like any other failed poll
+        repository = (resp.get("data") or {}).get("repository")
+        if resp.get("errors") or repository is None:
+            logger.warning(f"Check-runs query failed: {resp.get('errors')}")
+            return {pkg: None for pkg in pkg_shas}
+
+        result: dict[str, Optional[bool]] = {}
+        for alias, pkg in aliases.items():
+            commit = repository.get(alias)
+            if commit is None or commit.get("checkSuites") is None:
+                result[pkg] = None
+                continue
+
+            check_runs = [
+                {
+                    # GraphQL knows more pre-completion states than REST
+                    # (PENDING, REQUESTED, WAITING...), anything that is
+                    # not COMPLETED still counts as running
+                    "status": (
+                        "completed"
+                        if run["status"].casefold() == "completed"
+                        else "in_progress"
+                    ),
+                    "conclusion": (run["conclusion"] or "").casefold(),
+                }
+                for suite in commit["checkSuites"]["nodes"]
+                for run in suite["checkRuns"]["nodes"]
+            ]
+            result[pkg] = self._evaluate_check_runs(check_runs)
+
+        return result
+
+    async def _poll_all_check_runs(
+        self, pkg_shas: dict[str, str]
+    ) -> dict[str, Optional[bool]]:
+        gh_token = getenv("GITHUB_TOKEN")
+        if gh_token:
+            # one aliased GraphQL query for all commits instead of one
+            # REST round trip per package
+            return await self._poll_check_runs_via_graphql(pkg_shas, gh_token)
+
+        return {pkg: await self._get_check_runs_status(pkg) for pkg in pkg_shas}
 
     def _get_metadata_config(self, pkg_name: str) -> Optional[MetadataConfig]:
-        self._ensure_switching_to_branch(pkg_name)
+        cached_metadata = self._meta_cache.get(pkg_name)
+        if cached_metadata is not None:
+            return cached_metadata
+
+        worktree_path = self._worktrees.get(pkg_name)
+        if worktree_path is None:
+            logger.error(f"No worktree exists for package {pkg_name}")
+            return None
+
         try:
-            return MetadataConfig.get_config(self.cwd)
+            metadata = MetadataConfig.get_config(worktree_path)
         except (FileNotFoundError, AlpaConfException) as exc:
             logger.error(f"Exception during handling metadata.yaml occurred: {exc}")
             return None
 
-    def _notify_maintainers(self, maintainer_emails: list[str], pkg_name: str) -> None:
+        self._meta_cache[pkg_name] = metadata
+        return metadata
+
+    async def _notify_maintainers(
+        self, maintainer_emails: list[str], pkg_name: str
+    ) -> None:
+        mails = [
+            (
+                maintainer_mail,
+                f"[Alpa-autoupdate] Your update of package {pkg_name} failed",
+                MAIL_BODY.format(pkg_name=pkg_name),
+            )
+            for maintainer_mail in maintainer_emails
+        ]
         try:
-            for maintainer_mail in maintainer_emails:
-                self.mail_client.send_email(
-                    maintainer_mail,
-                    f"[Alpa-autoupdate] Your update of package {pkg_name} failed",
-                    MAIL_BODY.format(pkg_name=pkg_name),
-                )
+            await self.mail_client.send_emails(mails)
         except Exception as exc:
             logger.error(f"Sending mail failed: {exc}")
 
-    async def wait_for_check_run_to_end(self, pkg_name: str) -> bool:
+    @staticmethod
+    def _backoff_delay(attempt: int) -> float:
+        delay = min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)
+        return delay * (1 + random.uniform(-BACKOFF_JITTER, BACKOFF_JITTER))
+
+    async def _handle_failed_update(self, pkg_name: str) -> None:
+        self._cancel_update(pkg_name)
+        metadata = self._get_metadata_config(pkg_name)
+        if metadata is not None:
+            await self._notify_maintainers(
+                [user.email for user in metadata.maintainers], pkg_name
+            )
+
+    async def wait_for_check_run_to_end(self, pkg_names: list[str]) -> bool:
         # we have only 3000 free minutes on GH actions so fuck long builds
-        for _ in range(MAX_RETRY):
-            result = await self._wait_for_check_run_and_push_update(pkg_name)
-            if result is None:
-                # builds usually takes at least 2 minutes
-                await asyncio.sleep(120)
-                continue
+        pending = {pkg: self.pkg_commit_sha[pkg] for pkg in pkg_names}
+        waited = 0.0
+        attempt = 0
+        all_succeeded = True
+        while pending:
+            results = await self._poll_all_check_runs(pending)
+            finished = {
+                pkg: result for pkg, result in results.items() if result is not None
+            }
+            for pkg_name, result in finished.items():
+                del pending[pkg_name]
+                if not result:
+                    await self._handle_failed_update(pkg_name)
+                    all_succeeded = False
+                    continue
+
+                logger.info(
+                    f"Package {pkg_name} was successfully updated for all chroots"
+                )
+                all_succeeded &= await self._push_update(pkg_name)
+
+            if not pending:
+                break
 
-            if result:
-                return True
+            if finished:
+                # a check run transitioned, others are likely to follow soon
+                attempt = 0
 
-            self._cancel_update(pkg_name)
-            metadata = self._get_metadata_config(pkg_name)
-            if metadata is not None:
-                self._notify_maintainers(
-                    [user.email for user in metadata.maintainers], pkg_name
+            if waited >= MAX_WAIT_SECONDS:
+                logger.error(
+                    f"Update of packages {', '.join(pending)} timeouted after "
+                    f"{MAX_WAIT_SECONDS} seconds"
                 )
+                return False
 
-            return False
+            # short builds finish within a few quick polls, long builds
+            # back off up to BACKOFF_CAP so we don't hammer the API
+            delay = self._backoff_delay(attempt)
+            attempt += 1
+            waited += delay
+            await asyncio.sleep(delay)
 
-        logger.error(
-            f"Update of {pkg_name} package timeouted after {MAX_RETRY} retries"
-        )
-        return False
+        return all_succeeded
 
-    # since this code is asynchronous, a lot of switching to branches happens.
-    # This is why this method appears on multiple places so often
-    def _ensure_switching_to_branch(self, branch: str) -> None:
-        subprocess.run(
-            ["git", "switch", branch],
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=self.cwd,
-        )
+    # branch switching happens only inside the package's own worktree, so
+    # concurrently scheduled tasks can't pull the branch from under us
+    async def _ensure_switching_to_branch(
+        self, branch: str, worktree_path: Path
+    ) -> None:
+        if self._current_branches.get(worktree_path) == branch:
+            # already there, don't fork git just to find that out
+            return
+
+        await self._run_git_cmd("switch", branch, cwd=worktree_path)
+        self._current_branches[worktree_path] = branch
+
+    @staticmethod
+    def _pkg_is_up_to_date(specfile: Specfile, last_version_from_anytia: str) -> bool:
+        # the raw Version tag is enough for the common no-update case;
+        # expand macros (which may shell out to rpm) only when it has some
+        raw_version = specfile.version
+        if "%" not in raw_version:
+            return parse(last_version_from_anytia) == parse(raw_version)
+
+        return parse(last_version_from_anytia) == parse(specfile.expanded_version)
 
     async def update_package(self, pkg_name: str) -> bool:
+        worktree_path = await self._add_worktree(pkg_name)
+        if worktree_path is None:
+            return False
+
         pkg_metadata = self._get_metadata_config(pkg_name)
         if pkg_metadata is None:
             return False
@@ -303,31 +734,55 @@ class Autoupdator69:
             # TODO: some error or something
             return False
 
-        self._ensure_switching_to_branch(pkg_name)
-        specfile = Specfile(f"{self.cwd}/{pkg_name}.spec")
-        if parse(last_version_from_anytia) == parse(specfile.expanded_version):
+        specfile = Specfile(f"{worktree_path}/{pkg_name}.spec")
+        if self._pkg_is_up_to_date(specfile, last_version_from_anytia):
             logger.info(f"Package {pkg_name} has the most recent version")
             return True
 
-        self.pkg_commit_sha[pkg_name] = self._update_version_of_package(
-            specfile, last_version_from_anytia, pkg_name
+        self.pkg_commit_sha[pkg_name] = await self._update_version_of_package(
+            specfile, last_version_from_anytia, pkg_name, worktree_path
         )
-        return await self._push_changes(f"{UPDATE_BRANCH_PREFIX}_{pkg_name}")
+        if not await self._push_changes(self._update_branch(pkg_name)):
+            # the commit never reached the remote; polling its check runs
+            # would just wait for something that can't appear
+            del self.pkg_commit_sha[pkg_name]
+            return False
+
+        return True
+
+    async def _update_packages_in_worker_pool(self, packages: list[str]) -> None:
+        # only a bounded number of packages progresses at a time; firing
+        # hundreds of them at once detonates file descriptors (git +
+        # aiohttp + SMTP all keep some open)
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for pkg_name in packages:
+            queue.put_nowait(pkg_name)
+
+        async def worker() -> None:
+            while True:
+                try:
+                    pkg_name = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self.update_package(pkg_name)
+
+        workers = max(1, min(int(getenv("INPUT_CONCURRENCY", "8")), len(packages)))
+        await asyncio.gather(*(worker() for _ in range(workers)))
 
     async def _update_all_packages(self) -> int:
         # TODO: use return values for some retry and report logic
-        packages = self.local_repo.get_packages("")
-        await asyncio.gather(*(self.update_package(pkg) for pkg in packages))
-        if not self.pkg_commit_sha:
+        try:
+            packages = self.local_repo.get_packages("")
+            await self._update_packages_in_worker_pool(packages)
+            if not self.pkg_commit_sha:
+                return EXIT_SUCCESS
+
+            logger.info("Wait for 30 sec to give packit chance to react")
+            await asyncio.sleep(30)
+            await self.wait_for_check_run_to_end(list(self.pkg_commit_sha))
             return EXIT_SUCCESS
-
-        logger.info("Wait for 30 sec to give packit chance to react")
-        sleep(30)
-        updated_packages = self.pkg_commit_sha.keys()
-        await asyncio.gather(
-            *(self.wait_for_check_run_to_end(pkg) for pkg in updated_packages)
-        )
-        return EXIT_SUCCESS
+        finally:
+            await self._close_session()
 
     def run_autoupdate(self) -> int:
         asyncio.run(self._update_all_packages())